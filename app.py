@@ -1,5 +1,8 @@
 from flask import Flask, render_template, request, redirect, url_for, Response
 import os
+import tempfile
+import threading
+import time
 from ultralytics import YOLO
 import cv2
 from PIL import Image
@@ -7,13 +10,39 @@ import numpy as np
 
 app = Flask(__name__)
 
-# Configure upload and result folders
-UPLOAD_FOLDER = 'static/uploads'
+# Configure upload and result folders. Uploads are kept outside static/ so
+# they are never served while being processed.
+UPLOAD_FOLDER = tempfile.gettempdir()
 RESULT_FOLDER = 'static/results'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
+def env_int(name, default):
+    # Read a positive integer setting from the environment
+    value = os.environ.get(name, default)
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer, got {value!r}') from None
+    return max(value, 1)
+
+# Upload limits: maximum request body size (MB), maximum decoded image size
+# (pixels) and how many images may be decoded at once
+MAX_UPLOAD_MB = env_int('MAX_UPLOAD_MB', 16)
+MAX_IMAGE_PIXELS = env_int('MAX_IMAGE_PIXELS', 40_000_000)
+MAX_CONCURRENT_DECODES = env_int('MAX_CONCURRENT_DECODES', 2)
+
+# Per-upload result images older than this (seconds) are deleted
+RESULT_MAX_AGE = env_int('RESULT_MAX_AGE', 3600)
+
+# YOLO input size; larger images are decoded at reduced resolution
+MODEL_INPUT_SIZE = 640
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Caps the number of decoded images held in memory at the same time
+decode_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_DECODES)
+
 # Create folders if they don't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULT_FOLDER, exist_ok=True)
 
 # Load YOLO model
@@ -25,6 +54,59 @@ camera = None
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def load_image(path):
+    # Read only the header to get the dimensions and reject images whose
+    # decoded size would exceed MAX_IMAGE_PIXELS before decoding anything
+    too_large = f'Image is too large (maximum {MAX_IMAGE_PIXELS} pixels).'
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise ValueError(too_large) from None
+    except OSError:
+        raise ValueError('Could not read image.') from None
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(too_large)
+
+    # Let OpenCV decode at 1/2, 1/4 or 1/8 scale while the image stays at
+    # least MODEL_INPUT_SIZE. Only JPEG is scaled during decode and saves
+    # memory; other formats are decoded at full size and resized afterwards.
+    flags = cv2.IMREAD_COLOR
+    for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                            (4, cv2.IMREAD_REDUCED_COLOR_4),
+                            (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(width, height) // factor >= MODEL_INPUT_SIZE:
+            flags = reduced
+            break
+    image = cv2.imread(path, flags)
+    if image is None:
+        raise ValueError('Could not read image.')
+    return image
+
+def extract_detections(result):
+    detections = []
+    for r in result.boxes.data:
+        confidence = float(r[4])
+        class_id = int(r[5])
+        disease = result.names[class_id]
+        detections.append({
+            'disease': disease,
+            'confidence': round(confidence * 100, 2)  # Convert to percentage and round to 2 decimal places
+        })
+    return detections
+
+def prune_results():
+    # Remove per-upload result images once they are older than RESULT_MAX_AGE
+    cutoff = time.time() - RESULT_MAX_AGE
+    for name in os.listdir(RESULT_FOLDER):
+        path = os.path.join(RESULT_FOLDER, name)
+        if name.startswith('detect_'):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
 def get_camera():
     global camera
     if camera is None:
@@ -83,40 +165,51 @@ def upload_file():
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            # Save uploaded image
-            upload_path = os.path.join(UPLOAD_FOLDER, 'input_image.jpg')
-            file.save(upload_path)
-            
-            # Perform YOLO detection
-            results = model(upload_path)
+            # Save uploaded image to a temporary file that is removed once
+            # detection is done. The body size is bounded by
+            # MAX_CONTENT_LENGTH before it gets here.
+            tmp = tempfile.NamedTemporaryFile(dir=UPLOAD_FOLDER, suffix='.part', delete=False)
+            tmp.close()
+            try:
+                file.save(tmp.name)
+                
+                with decode_semaphore:
+                    try:
+                        image = load_image(tmp.name)
+                    except ValueError as e:
+                        return render_template('index.html', error=str(e)), 400
+                    
+                    # Perform YOLO detection
+                    results = model(image)
+                    detections = extract_detections(results[0])
+                    
+                    # Save the result image under a name unique to this upload
+                    # so it always matches the detections shown with it
+                    fd, result_path = tempfile.mkstemp(dir=RESULT_FOLDER, prefix='detect_', suffix='.jpg')
+                    os.close(fd)
+                    
+                    # Plot results and save
+                    res_plotted = results[0].plot()
+                    cv2.imwrite(result_path, res_plotted)
+            finally:
+                if os.path.exists(tmp.name):
+                    os.remove(tmp.name)
             
-            # Save the result image
-            result_path = os.path.join(RESULT_FOLDER, 'result_image.jpg')
+            prune_results()
             
-            # Plot results and save
-            res_plotted = results[0].plot()
-            cv2.imwrite(result_path, res_plotted)
-            
-            return redirect(url_for('show_result'))
+            return render_template('result.html', detections=detections,
+                                   result_image=os.path.basename(result_path))
     
     return render_template('index.html')
 
+@app.errorhandler(413)
+def upload_too_large(error):
+    return render_template('index.html', error=f'File is too large (maximum {MAX_UPLOAD_MB} MB).'), 413
+
 @app.route('/result')
 def show_result():
-    results = model(os.path.join(UPLOAD_FOLDER, 'input_image.jpg'))
-    
-    # Extract detection results
-    detections = []
-    for r in results[0].boxes.data:
-        confidence = float(r[4])
-        class_id = int(r[5])
-        disease = results[0].names[class_id]
-        detections.append({
-            'disease': disease,
-            'confidence': round(confidence * 100, 2)  # Convert to percentage and round to 2 decimal places
-        })
-    
-    return render_template('result.html', detections=detections)
+    # Results are rendered directly by upload_file; there is nothing to show here
+    return redirect(url_for('upload_file'))
 
 @app.teardown_appcontext
 def cleanup(exception=None):